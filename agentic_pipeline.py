@@ -4,39 +4,86 @@ Agentic Search Pipeline using ByteRover
 Uses brv query commands to retrieve relevant files
 """
 
+import functools
+import gzip
 import json
 import os
 import re
+import shutil
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from typing import List, Dict, Any, Set
-import tiktoken
+import orjson
 from tqdm import tqdm
 
+from token_utils import count_tokens_batch, get_encoder
+
+# RE2 matches in linear time with no backtracking; fall back to stdlib re if unavailable.
+# RE2's \b only treats ASCII letters, digits and _ as word characters, so the fallback
+# is compiled with re.ASCII to extract exactly the same paths on either engine.
+try:
+    import re2
+    _compile_regex = re2.compile
+except ImportError:
+    _compile_regex = functools.partial(re.compile, flags=re.ASCII)
+
+# Seconds a brv process stopped by --early-exit gets to exit before it is killed
+BRV_TERMINATE_GRACE = 5
+
+# Top-level directories that source paths in responses are expected to start with
+_PATH_PREFIXES = ("packages/", "scripts/", "docs/", "integration-tests/", "schemas/")
+
+# Python's Unicode \s spelled out, since RE2's \s only covers ASCII whitespace
+_WHITESPACE = "[\t-\r\x1c- \x85\xa0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000]"
+
+# Patterns for pulling file paths out of brv responses, in order of preference
+_FILE_RE = _compile_regex('(?m)^FILE:' + _WHITESPACE + '*(.+)$')
+_PATH_RE = _compile_regex(
+    r'\b((?:packages|scripts|docs|integration-tests|schemas)/[a-zA-Z0-9_\-/\.]+\.[a-zA-Z]{2,4})\b'
+)
+
+# Both fallback patterns as one alternation so they share a single scan
+_FALLBACK_RE = _compile_regex(
+    r'\b(?P<path>(?:packages|scripts|docs|integration-tests|schemas)/[a-zA-Z0-9_\-/\.]+\.[a-zA-Z]{2,4})\b'
+    r'|`(?P<code>[^`]+\.[a-zA-Z]{2,4})`'
+)
+
 
 class AgenticPipeline:
     def __init__(
         self,
         codebase_path: str,
-        max_files: int = 10
+        max_files: int = 10,
+        max_workers: int = 8,
+        query_timeout: float = 60,
+        early_exit: bool = False,
+        verbose: bool = False
     ):
         self.codebase_path = Path(codebase_path)
         self.max_files = max_files
+        self.max_workers = max_workers
+        self.query_timeout = query_timeout
+        # Terminate brv as soon as max_files FILE: lines have been streamed.
+        # Token usage then only covers the response up to that point.
+        self.early_exit = early_exit
+        self.verbose = verbose
+
+        # Resolve the brv executable once instead of searching PATH on every query
+        self.brv_command = shutil.which("brv") or "brv"
+        self.codebase_dir = str(self.codebase_path)
 
         # Initialize tokenizer for token counting
         try:
-            self.token_counter = tiktoken.get_encoding("cl100k_base")
+            self.token_counter = get_encoder()
         except Exception as e:
             print(f"Warning: Could not load tiktoken: {e}")
             self.token_counter = None
 
-    def count_tokens(self, text: str) -> int:
-        """Count tokens in text"""
-        if self.token_counter:
-            return len(self.token_counter.encode(text))
-        else:
-            # Fallback: approximate 4 chars per token
-            return len(text) // 4
+    def count_tokens_batch(self, texts: List[str]) -> List[int]:
+        """Count tokens for many texts in a single batched tiktoken call"""
+        return count_tokens_batch(self.token_counter, texts)
 
     def run_brv_query(self, question: str) -> str:
         """Run brv query command and return the response"""
@@ -66,75 +113,176 @@ FILE: packages/core/src/config/config.ts
 DO NOT include .brv/ paths. Only list actual source code files."""
 
         try:
-            # Run brv query in the codebase directory
-            result = subprocess.run(
-                ["brv", "query", enhanced_query],
-                cwd=str(self.codebase_path),
-                capture_output=True,
-                text=True,
-                timeout=60
+            # Run brv query in the codebase directory, reading its output as it streams
+            proc = subprocess.Popen(
+                [self.brv_command, "query", enhanced_query],
+                cwd=self.codebase_dir,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True
             )
+        except Exception as e:
+            tqdm.write(f"Error running brv query: {e}")
+            return ""
 
-            if result.returncode != 0:
-                print(f"Error running brv query: {result.stderr}")
-                return ""
+        # Reading stdout blocks, so enforce the timeout from a timer thread
+        timed_out = threading.Event()
 
-            return result.stdout
-        except subprocess.TimeoutExpired:
-            print("brv query timed out")
-            return ""
+        def kill_on_timeout():
+            timed_out.set()
+            proc.kill()
+
+        timer = threading.Timer(self.query_timeout, kill_on_timeout)
+        timer.start()
+
+        # Drain stderr on its own thread so a chatty brv can't fill the pipe and stall stdout
+        stderr_chunks = []
+        stderr_reader = threading.Thread(
+            target=lambda: stderr_chunks.append(proc.stderr.read()),
+            daemon=True
+        )
+        stderr_reader.start()
+
+        lines = []
+        found_paths = set()
+        stopped_early = False
+        try:
+            for line in proc.stdout:
+                lines.append(line)
+
+                if not self.early_exit:
+                    continue
+
+                match = _FILE_RE.match(line)
+                if match:
+                    path = match.group(1).strip().replace('\\', '/')
+                    if path and not path.startswith('.brv/'):
+                        found_paths.add(path)
+
+                # Stop brv once it has listed as many files as will be kept
+                if len(found_paths) >= self.max_files:
+                    stopped_early = True
+                    proc.terminate()
+                    break
+
+            if stopped_early:
+                # Don't wait for the rest of the output, just reap the process,
+                # killing it if it ignores the terminate
+                proc.stdout.close()
+                try:
+                    proc.wait(timeout=BRV_TERMINATE_GRACE)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                    proc.wait()
+            else:
+                proc.wait()
+                stderr_reader.join()
         except Exception as e:
-            print(f"Error running brv query: {e}")
+            proc.kill()
+            proc.wait()
+            tqdm.write(f"Error running brv query: {e}")
             return ""
+        finally:
+            timer.cancel()
+
+        # The paths listed before stopping are kept even if brv had to be killed
+        if stopped_early:
+            return "".join(lines)
+
+        if timed_out.is_set():
+            tqdm.write("brv query timed out")
+            return ""
+
+        if proc.returncode != 0:
+            tqdm.write(f"Error running brv query: {''.join(stderr_chunks)}")
+            return ""
+
+        return "".join(lines)
 
     def extract_file_paths(self, response: str) -> List[str]:
         """Extract file paths from brv query response"""
         file_paths = []
 
         # Method 1: Look for lines starting with "FILE:"
-        file_pattern = re.compile(r'^FILE:\s*(.+)$', re.MULTILINE)
-        matches = file_pattern.findall(response)
-        file_paths.extend([m.strip() for m in matches])
-
-        # Method 2: Look for common path patterns if no FILE: markers found
-        if not file_paths:
-            # Match paths like packages/core/src/file.ts
-            path_pattern = re.compile(
-                r'\b((?:packages|scripts|docs|integration-tests|schemas)/[a-zA-Z0-9_\-/\.]+\.[a-zA-Z]{2,4})\b'
-            )
-            matches = path_pattern.findall(response)
-            file_paths.extend(matches)
-
-        # Method 3: Look for markdown code blocks with file paths
-        if not file_paths:
-            code_block_pattern = re.compile(r'`([^`]+\.[a-zA-Z]{2,4})`')
-            matches = code_block_pattern.findall(response)
-            # Filter to only include paths with slashes
-            file_paths.extend([m for m in matches if '/' in m])
-
-        # Remove duplicates while preserving order and filter out .brv paths
-        seen = set()
-        unique_paths = []
-        for path in file_paths:
-            # Normalize path
-            normalized = path.strip().replace('\\', '/')
-            # Filter out .brv context tree files (only keep source code files)
-            if normalized and normalized not in seen and not normalized.startswith('.brv/'):
-                seen.add(normalized)
-                unique_paths.append(normalized)
-
-        # Limit to max_files
-        return unique_paths[:self.max_files]
-
-    def read_file_content(self, file_path: str) -> str:
-        """Read content of a file for token counting"""
-        try:
-            full_path = self.codebase_path / file_path
-            if full_path.exists() and full_path.is_file():
-                return full_path.read_text(encoding="utf-8", errors="ignore")
-        except Exception as e:
-            print(f"Error reading {file_path}: {e}")
-        return ""
+        if "FILE:" in response:
+            file_paths = [m.strip() for m in _FILE_RE.findall(response)]
+
+        # Methods 2 and 3 are only needed if no FILE: markers were found, and
+        # can only match if the response has a path prefix or a backtick
+        if not file_paths and ("`" in response or any(prefix in response for prefix in _PATH_PREFIXES)):
+            path_matches = []
+            code_paths = []
+            for match in _FALLBACK_RE.finditer(response):
+                if match.lastgroup == "path":
+                    # Method 2: common path patterns like packages/core/src/file.ts
+                    path_matches.append(match.group("path"))
+                else:
+                    code = match.group("code")
+                    # Paths inside backticks are consumed by this branch, so look
+                    # for common path patterns within them as well
+                    path_matches.extend(_PATH_RE.findall(code))
+                    # Method 3: markdown code blocks with file paths
+                    if '/' in code:
+                        code_paths.append(code)
+
+            # Code block paths are only used when no path patterns matched
+            file_paths = path_matches or code_paths
+
+        # Normalize paths and filter out .brv context tree files (only keep source code files)
+        normalized = (path.strip().replace('\\', '/') for path in file_paths)
+        source_paths = (path for path in normalized if path and not path.startswith('.brv/'))
+
+        # Remove duplicates while preserving order, then limit to max_files
+        return list(dict.fromkeys(source_paths))[:self.max_files]
+
+    def process_question(self, question: Dict[str, Any]) -> Dict[str, Any]:
+        """Query brv for a single question and compute its metrics"""
+        # Run brv query
+        response = self.run_brv_query(question["question"])
+
+        if not response:
+            tqdm.write(f"Warning: No response for question {question['id']}")
+            return {
+                "question_id": question["id"],
+                "question": question["question"],
+                "type": question["type"],
+                "ground_truth": question["ground_truth"],
+                "retrieved": [],
+                "response": "",
+                "metrics": {
+                    "iou": 0.0,
+                    "token_usage": 0,
+                    "precision": 0.0,
+                    "recall": 0.0
+                }
+            }
+
+        # Extract file paths from response
+        retrieved_paths = self.extract_file_paths(response)
+
+        # Calculate intersection over union metric
+        ground_truth = question["_gt_set"]
+        retrieved_set = set(retrieved_paths)
+
+        intersection = len(ground_truth & retrieved_set)
+        union = len(ground_truth | retrieved_set)
+        iou_score = intersection / union if union > 0 else 0
+
+        return {
+            "question_id": question["id"],
+            "question": question["question"],
+            "type": question["type"],
+            "ground_truth": question["ground_truth"],
+            "retrieved": retrieved_paths,
+            "response": response,
+            "metrics": {
+                "iou": iou_score,
+                # Filled in by run_evaluation with a single batched count
+                "token_usage": 0,
+                "precision": intersection / len(retrieved_set) if retrieved_set else 0,
+                "recall": intersection / len(ground_truth) if ground_truth else 0
+            }
+        }
 
     def run_evaluation(self, questions_file: str, output_file: str):
         """Run evaluation on questions and save results"""
@@ -143,71 +291,80 @@ DO NOT include .brv/ paths. Only list actual source code files."""
             questions_data = json.load(f)
 
         questions = questions_data["questions"]
-        results = []
-
-        print(f"Processing {len(questions)} questions...")
-        for question in tqdm(questions, desc="Evaluating questions"):
-            # Run brv query
-            response = self.run_brv_query(question["question"])
-
-            if not response:
-                print(f"Warning: No response for question {question['id']}")
-                results.append({
-                    "question_id": question["id"],
-                    "question": question["question"],
-                    "type": question["type"],
-                    "ground_truth": question["ground_truth"],
-                    "retrieved": [],
-                    "response": "",
-                    "metrics": {
-                        "iou": 0.0,
-                        "token_usage": 0,
-                        "precision": 0.0,
-                        "recall": 0.0
-                    }
-                })
-                continue
-
-            # Extract file paths from response
-            retrieved_paths = self.extract_file_paths(response)
-
-            # Count tokens in the entire response
-            response_tokens = self.count_tokens(response)
-
-            # Calculate intersection over union metric
-            ground_truth = set(question["ground_truth"])
-            retrieved_set = set(retrieved_paths)
-
-            intersection = len(ground_truth & retrieved_set)
-            union = len(ground_truth | retrieved_set)
-            iou_score = intersection / union if union > 0 else 0
-
-            result = {
-                "question_id": question["id"],
-                "question": question["question"],
-                "type": question["type"],
-                "ground_truth": question["ground_truth"],
-                "retrieved": retrieved_paths,
-                "response": response,
-                "metrics": {
-                    "iou": iou_score,
-                    "token_usage": response_tokens,
-                    "precision": intersection / len(retrieved_set) if retrieved_set else 0,
-                    "recall": intersection / len(ground_truth) if ground_truth else 0
-                }
+
+        # Build each question's ground truth set once up front
+        for question in questions:
+            question["_gt_set"] = frozenset(question["ground_truth"])
+
+        print(f"Processing {len(questions)} questions with {self.max_workers} workers...")
+        # brv queries are independent external processes, so run them concurrently
+        # and restore the original question order once all have completed
+        indexed_results = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {
+                pool.submit(self.process_question, question): idx
+                for idx, question in enumerate(questions)
             }
-            results.append(result)
+            for future in tqdm(
+                as_completed(futures),
+                total=len(futures),
+                desc="Evaluating questions",
+                mininterval=0.5
+            ):
+                indexed_results[futures[future]] = future.result()
+
+        results = [indexed_results[idx] for idx in range(len(questions))]
+
+        # Create results directory if it doesn't exist
+        output_path = Path(output_file)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
 
-            # Print summary for this question
-            print(f"\nQ{question['id']}: IoU={iou_score:.3f}, "
-                  f"Tokens={response_tokens}, "
-                  f"Retrieved={len(retrieved_paths)} files")
+        # Per-question results go to a JSON-lines file next to the summary,
+        # written one record at a time
+        results_path = output_path.with_name(output_path.name + ".ndjson")
+        print(f"\nWriting per-question results to {results_path}...")
+
+        # Full brv responses are archived as gzip files; the results keep a preview.
+        # Each output file gets its own directory, cleared so no stale archives remain.
+        responses_dir = output_path.with_name(output_path.name + ".responses")
+        shutil.rmtree(responses_dir, ignore_errors=True)
+        responses_dir.mkdir(parents=True, exist_ok=True)
+
+        # Count tokens in every response at once instead of per question
+        token_counts = self.count_tokens_batch([r["response"] or "" for r in results])
+
+        # Fill in token usage, write each result and accumulate aggregate metrics in one pass
+        sum_iou = sum_tokens = sum_precision = sum_recall = 0.0
+        with open(results_path, 'wb') as results_f:
+            for result, response_tokens in zip(results, token_counts):
+                metrics = result["metrics"]
+                metrics["token_usage"] = response_tokens
+
+                response = result.pop("response")
+                result["response_preview"] = response[:500]
+                result["response_len"] = len(response)
+                if response:
+                    response_file = responses_dir / f"{result['question_id']}.txt.gz"
+                    with gzip.open(response_file, 'wt', encoding='utf-8') as gz:
+                        gz.write(response)
+
+                results_f.write(orjson.dumps(result) + b"\n")
+
+                sum_iou += metrics["iou"]
+                sum_tokens += response_tokens
+                sum_precision += metrics["precision"]
+                sum_recall += metrics["recall"]
+
+                if self.verbose:
+                    print(f"Q{result['question_id']}: IoU={metrics['iou']:.3f} "
+                          f"Tok={response_tokens} N={len(result['retrieved'])}")
 
         # Calculate aggregate metrics
-        avg_iou = sum(r["metrics"]["iou"] for r in results) / len(results) if results else 0
-        avg_tokens = sum(r["metrics"]["token_usage"] for r in results) / len(results) if results else 0
-        avg_precision = sum(r["metrics"]["precision"] for r in results) / len(results) if results else 0
-        avg_recall = sum(r["metrics"]["recall"] for r in results) / len(results) if results else 0
+        n = len(results) or 1
+        avg_iou = sum_iou / n
+        avg_tokens = sum_tokens / n
+        avg_precision = sum_precision / n
+        avg_recall = sum_recall / n
 
         output_data = {
             "approach": "Agentic Search (ByteRover)",
@@ -219,16 +376,12 @@ DO NOT include .brv/ paths. Only list actual source code files."""
                 "avg_precision": avg_precision,
                 "avg_recall": avg_recall
             },
-            "results": results
+            "results_file": results_path.name
         }
 
         print(f"\nSaving results to {output_file}...")
-        # Create results directory if it doesn't exist
-        output_path = Path(output_file)
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-
-        with open(output_file, 'w') as f:
-            json.dump(output_data, f, indent=2)
+        with open(output_file, 'wb') as f:
+            f.write(orjson.dumps(output_data, option=orjson.OPT_INDENT_2))
 
         print("\n=== Agentic Search Pipeline Results ===")
         print(f"Average IoU: {avg_iou:.3f}")
@@ -265,6 +418,22 @@ def main():
         default=10,
         help="Maximum number of files to retrieve per question"
     )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=8,
+        help="Number of brv queries to run concurrently"
+    )
+    parser.add_argument(
+        "--early-exit",
+        action="store_true",
+        help="Stop each brv query once max-files FILE: lines are received (truncates token usage)"
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Print a one-line summary for every question"
+    )
 
     args = parser.parse_args()
 
@@ -288,7 +457,10 @@ def main():
 
     pipeline = AgenticPipeline(
         codebase_path=args.codebase,
-        max_files=args.max_files
+        max_files=args.max_files,
+        max_workers=args.max_workers,
+        early_exit=args.early_exit,
+        verbose=args.verbose
     )
 
     pipeline.run_evaluation(args.questions, args.output)
@@ -4,11 +4,51 @@ Compare RAG and Agentic Search Results
 Generates comparison report and metrics
 """
 
+import heapq
 import json
+import mmap
+from collections import defaultdict
 from pathlib import Path
 from typing import Dict, Any, List
 import sys
 
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Column order of the per-question metric arrays
+METRIC_KEYS = ("iou", "token_usage", "precision", "recall")
+
+
+def metrics_array(results: List[Dict[str, Any]]) -> np.ndarray:
+    """Stack per-question metrics into an (N, len(METRIC_KEYS)) array"""
+    return np.array(
+        [[r["metrics"][key] for key in METRIC_KEYS] for r in results],
+        dtype=np.float64
+    ).reshape(-1, len(METRIC_KEYS))
+
+
+def type_means(metrics: np.ndarray, indices: np.ndarray) -> Dict[str, float]:
+    """Average each metric over the questions at the given indices"""
+    means = metrics[indices].mean(axis=0)
+    return dict(zip(METRIC_KEYS, means.tolist()))
+
+
+def _load_json(path: Path) -> Any:
+    """Parse a JSON file, using orjson on a memory-mapped buffer when available"""
+    if orjson is None:
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as buffer:
+                return orjson.loads(buffer)
+
 
 class ResultsComparator:
     def __init__(self, rag_results_file: str, agentic_results_file: str):
@@ -16,16 +56,44 @@ class ResultsComparator:
         self.agentic_results_file = agentic_results_file
         self.rag_data = None
         self.agentic_data = None
+        self.rag_metrics = None
+        self.agentic_metrics = None
+        self.type_indices = None
+
+    def load_ndjson(self, results_file: Path) -> List[Dict[str, Any]]:
+        """Load per-question results from a JSON-lines file"""
+        loads = orjson.loads if orjson is not None else json.loads
+        with open(results_file, 'rb') as f:
+            return [loads(line) for line in f if line.strip()]
+
+    def load_result_file(self, results_file: str) -> Dict[str, Any]:
+        """Load a results file, pulling in its JSON-lines results if stored separately"""
+        data = _load_json(Path(results_file))
+
+        if "results" not in data and "results_file" in data:
+            data["results"] = self.load_ndjson(Path(results_file).parent / data["results_file"])
+
+        return data
 
     def load_results(self):
         """Load both result files"""
         print("Loading results...")
 
-        with open(self.rag_results_file, 'r') as f:
-            self.rag_data = json.load(f)
+        self.rag_data = self.load_result_file(self.rag_results_file)
+        self.agentic_data = self.load_result_file(self.agentic_results_file)
 
-        with open(self.agentic_results_file, 'r') as f:
-            self.agentic_data = json.load(f)
+        # Per-question metrics as arrays for vectorized aggregation
+        self.rag_metrics = metrics_array(self.rag_data["results"])
+        self.agentic_metrics = metrics_array(self.agentic_data["results"])
+
+        # Group question positions by type in one pass. Both result files list
+        # questions in the same order, so these indices apply to either side.
+        by_type = defaultdict(list)
+        for i, r in enumerate(self.rag_data["results"]):
+            by_type[r["type"]].append(i)
+        self.type_indices = {
+            qtype: np.array(indices) for qtype, indices in sorted(by_type.items())
+        }
 
         print(f"Loaded {len(self.rag_data['results'])} RAG results")
         print(f"Loaded {len(self.agentic_data['results'])} Agentic results")
@@ -49,7 +117,7 @@ class ResultsComparator:
                              rag_metrics["avg_recall"] * 100) if rag_metrics["avg_recall"] > 0 else 0
 
         # Generate markdown report
-        report = f"""# RAG vs Agentic Search: Experimental Results
+        parts = [f"""# RAG vs Agentic Search: Experimental Results
 
 ## Experiment Configuration
 
@@ -93,36 +161,35 @@ class ResultsComparator:
 
 ## Performance by Question Type
 
-"""
+"""]
 
         # Analyze by question type
-        question_types = set(q["type"] for q in self.rag_data["results"])
-
-        for qtype in sorted(question_types):
-            rag_type_results = [r for r in self.rag_data["results"] if r["type"] == qtype]
-            agentic_type_results = [r for r in self.agentic_data["results"] if r["type"] == qtype]
+        for qtype, indices in self.type_indices.items():
+            rag_count = len(indices)
+            rag_avg = type_means(self.rag_metrics, indices)
+            agentic_avg = type_means(self.agentic_metrics, indices)
 
-            rag_avg_iou = sum(r["metrics"]["iou"] for r in rag_type_results) / len(rag_type_results)
-            agentic_avg_iou = sum(r["metrics"]["iou"] for r in agentic_type_results) / len(agentic_type_results)
+            rag_avg_iou = rag_avg["iou"]
+            agentic_avg_iou = agentic_avg["iou"]
 
-            rag_avg_tokens = sum(r["metrics"]["token_usage"] for r in rag_type_results) / len(rag_type_results)
-            agentic_avg_tokens = sum(r["metrics"]["token_usage"] for r in agentic_type_results) / len(agentic_type_results)
+            rag_avg_tokens = rag_avg["token_usage"]
+            agentic_avg_tokens = agentic_avg["token_usage"]
 
-            report += f"""### {qtype.capitalize()} Questions ({len(rag_type_results)} questions)
+            parts.append(f"""### {qtype.capitalize()} Questions ({rag_count} questions)
 
 | Metric | RAG | Agentic Search |
 |--------|-----|----------------|
 | IoU Score | {rag_avg_iou:.3f} | {agentic_avg_iou:.3f} |
 | Token Usage | {rag_avg_tokens:.0f} | {agentic_avg_tokens:.0f} |
 
-"""
+""")
 
         # Add detailed results section
-        report += """## Detailed Results
+        parts.append("""## Detailed Results
 
 ### Top 5 Best Performing Questions (Agentic Search)
 
-"""
+""")
         # Sort by IoU improvement
         comparison_results = []
         for i, rag_r in enumerate(self.rag_data["results"]):
@@ -136,55 +203,57 @@ class ResultsComparator:
                 "agentic_iou": agentic_r["metrics"]["iou"]
             })
 
-        top_5 = sorted(comparison_results, key=lambda x: x["iou_diff"], reverse=True)[:5]
+        top_5 = heapq.nlargest(5, comparison_results, key=lambda x: x["iou_diff"])
         for item in top_5:
-            report += f"""**{item['question_id']}**: {item['question']}
+            parts.append(f"""**{item['question_id']}**: {item['question']}
 - RAG IoU: {item['rag_iou']:.3f}
 - Agentic IoU: {item['agentic_iou']:.3f}
 - Improvement: {item['iou_diff']:+.3f}
 
-"""
+""")
 
-        report += """### Top 5 Worst Performing Questions (Agentic Search)
+        parts.append("""### Top 5 Worst Performing Questions (Agentic Search)
 
-"""
-        bottom_5 = sorted(comparison_results, key=lambda x: x["iou_diff"])[:5]
+""")
+        bottom_5 = heapq.nsmallest(5, comparison_results, key=lambda x: x["iou_diff"])
         for item in bottom_5:
-            report += f"""**{item['question_id']}**: {item['question']}
+            parts.append(f"""**{item['question_id']}**: {item['question']}
 - RAG IoU: {item['rag_iou']:.3f}
 - Agentic IoU: {item['agentic_iou']:.3f}
 - Difference: {item['iou_diff']:+.3f}
 
-"""
+""")
 
         # Add conclusion
-        report += f"""## Conclusion
+        parts.append(f"""## Conclusion
 
 Based on this experiment with {len(self.rag_data['results'])} questions across the gemini-cli codebase:
 
-"""
+""")
         if agentic_metrics['avg_iou'] > rag_metrics['avg_iou'] and token_reduction > 0:
-            report += f"""**Agentic Search (ByteRover) outperforms RAG on both accuracy and efficiency:**
+            parts.append(f"""**Agentic Search (ByteRover) outperforms RAG on both accuracy and efficiency:**
 - {abs(iou_improvement):.1f}% better retrieval accuracy (IoU)
 - {abs(token_reduction):.1f}% reduction in token usage
 - Better precision and recall on average
 
 This validates the claim that context trees and agentic search are superior to traditional vector-based RAG for code retrieval.
-"""
+""")
         elif agentic_metrics['avg_iou'] > rag_metrics['avg_iou']:
-            report += f"""**Agentic Search (ByteRover) shows better accuracy but uses more tokens:**
+            parts.append(f"""**Agentic Search (ByteRover) shows better accuracy but uses more tokens:**
 - {abs(iou_improvement):.1f}% better retrieval accuracy (IoU)
 - However, uses {abs(token_reduction):.1f}% more tokens
 
 The trade-off may be justified for applications where accuracy is more critical than token efficiency.
-"""
+""")
         else:
-            report += f"""**Results show mixed performance:**
+            parts.append(f"""**Results show mixed performance:**
 - IoU difference: {iou_improvement:+.1f}%
 - Token usage difference: {token_reduction:+.1f}%
 
 Further analysis and tuning may be needed to optimize both approaches.
-"""
+""")
+
+        report = "".join(parts)
 
         # Save report
         print(f"\nSaving comparison report to {output_file}...")
@@ -226,17 +295,16 @@ Further analysis and tuning may be needed to optimize both approaches.
         }
 
         # Group by question type
-        question_types = set(q["type"] for q in self.rag_data["results"])
-        for qtype in question_types:
-            rag_type = [r for r in self.rag_data["results"] if r["type"] == qtype]
-            agentic_type = [r for r in self.agentic_data["results"] if r["type"] == qtype]
+        for qtype, indices in self.type_indices.items():
+            rag_avg = type_means(self.rag_metrics, indices)
+            agentic_avg = type_means(self.agentic_metrics, indices)
 
             summary["by_question_type"][qtype] = {
-                "count": len(rag_type),
-                "rag_avg_iou": sum(r["metrics"]["iou"] for r in rag_type) / len(rag_type),
-                "agentic_avg_iou": sum(r["metrics"]["iou"] for r in agentic_type) / len(agentic_type),
-                "rag_avg_tokens": sum(r["metrics"]["token_usage"] for r in rag_type) / len(rag_type),
-                "agentic_avg_tokens": sum(r["metrics"]["token_usage"] for r in agentic_type) / len(agentic_type)
+                "count": len(indices),
+                "rag_avg_iou": rag_avg["iou"],
+                "agentic_avg_iou": agentic_avg["iou"],
+                "rag_avg_tokens": rag_avg["token_usage"],
+                "agentic_avg_tokens": agentic_avg["token_usage"]
             }
 
         with open(output_file, 'w') as f:
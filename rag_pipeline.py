@@ -4,21 +4,53 @@ RAG Pipeline for Code Question Answering
 Uses Qdrant vector database with OpenAI text-embedding-3-small
 """
 
-import json
+import asyncio
+import hashlib
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any
-import tiktoken
+from typing import List, Dict, Any, Optional, Tuple
+import diskcache
+import openai
+import orjson
 from tqdm import tqdm
 from dotenv import load_dotenv
-from openai import OpenAI
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from openai import AsyncOpenAI, OpenAI
 
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
+from qdrant_client import models
+from qdrant_client.models import Distance, PayloadSchemaType, PointStruct, VectorParams
+
+from token_utils import count_tokens_batch, get_encoder
 
 # Load environment variables
 load_dotenv()
 
+# OpenAI embedding limits: tokens per input, inputs per request we send, tokens per request
+MAX_EMBEDDING_TOKENS = 8191
+EMBEDDING_BATCH_SIZE = 64
+MAX_TOKENS_PER_REQUEST = 300_000
+
+# Files are embedded as overlapping token windows; short files are embedded whole
+CHUNK_TOKENS = 1024
+CHUNK_OVERLAP_TOKENS = 128
+MIN_CHUNK_CHARS = 2000
+
+# Points per Qdrant upload request, and worker processes for bulk uploads
+UPLOAD_BATCH_SIZE = 256
+UPLOAD_PARALLEL = 4
+
+# Evaluation queries embedded and searched per request; batched searches fetch
+# extra chunks per query so they can be grouped into top-k distinct files
+QUERY_BATCH_SIZE = 256
+RETRIEVE_OVERSAMPLING = 4
+
+
+def approx_tokens(text: str) -> int:
+    """Estimate a token count from UTF-8 length (~3.5 bytes per token on code) without running BPE"""
+    return len(text.encode("utf-8")) * 10 // 35
+
 
 class RAGPipeline:
     def __init__(
@@ -26,19 +58,33 @@ class RAGPipeline:
         codebase_path: str,
         qdrant_host: str = "localhost",
         qdrant_port: int = 6333,
+        qdrant_grpc_port: int = 6334,
         collection_name: str = "gemini_cli_code",
         model_name: str = "text-embedding-3-small",
-        top_k: int = 10
+        top_k: int = 10,
+        max_concurrency: int = 16,
+        cache_dir: str = "./.embed_cache"
     ):
         self.codebase_path = Path(codebase_path)
         self.collection_name = collection_name
         self.top_k = top_k
         self.model_name = model_name
+        self.max_concurrency = max_concurrency
         self.embedding_dim = 1536  # text-embedding-3-small dimension
 
+        # Search the quantized index with 2x oversampling, rescoring candidates at full precision
+        self.search_params = models.SearchParams(
+            quantization=models.QuantizationSearchParams(rescore=True, oversampling=2.0)
+        )
+
         # Initialize Qdrant client
-        print(f"Connecting to Qdrant at {qdrant_host}:{qdrant_port}...")
-        self.qdrant_client = QdrantClient(host=qdrant_host, port=qdrant_port)
+        print(f"Connecting to Qdrant at {qdrant_host}:{qdrant_grpc_port} (gRPC)...")
+        self.qdrant_client = QdrantClient(
+            host=qdrant_host,
+            port=qdrant_port,
+            grpc_port=qdrant_grpc_port,
+            prefer_grpc=True
+        )
 
         # Initialize OpenAI client
         api_key = os.getenv("OPENAI_API_KEY")
@@ -46,38 +92,162 @@ class RAGPipeline:
             raise ValueError("OPENAI_API_KEY not found in environment variables")
 
         self.openai_client = OpenAI(api_key=api_key)
+        # Async client lets indexing issue many embedding requests concurrently
+        self.async_openai_client = AsyncOpenAI(api_key=api_key, timeout=30)
         print(f"Using OpenAI embedding model: {model_name}")
 
         # Initialize tokenizer for token counting
         try:
-            self.token_counter = tiktoken.get_encoding("cl100k_base")
+            self.token_counter = get_encoder()
         except Exception as e:
             print(f"Warning: Could not load tiktoken: {e}")
             self.token_counter = None
 
-    def count_tokens(self, text: str) -> int:
-        """Count tokens in text using tiktoken"""
+        # Embeddings keyed by content hash, so unchanged files are never re-embedded
+        self.embedding_cache = diskcache.Cache(cache_dir)
+
+    def count_tokens_batch(self, texts: List[str]) -> List[int]:
+        """Count tokens for many texts in a single batched tiktoken call"""
+        return count_tokens_batch(self.token_counter, texts)
+
+    def truncate_for_embedding(self, text: str) -> str:
+        """Truncate text to the embedding model's input limit"""
+        # Every token covers at least one byte, so short inputs can't hit the limit
+        if len(text.encode("utf-8")) <= MAX_EMBEDDING_TOKENS:
+            return text
+
         if self.token_counter:
-            return len(self.token_counter.encode(text))
-        else:
-            # Fallback: approximate 4 chars per token
-            return len(text) // 4
+            tokens = self.token_counter.encode_ordinary(text)
+            if len(tokens) > MAX_EMBEDDING_TOKENS:
+                return self.token_counter.decode(tokens[:MAX_EMBEDDING_TOKENS])
+
+        return text
 
     def embed_text(self, text: str) -> List[float]:
         """Generate embedding for a given text using OpenAI API"""
-        # OpenAI has a max input of ~8191 tokens for embeddings
-        # Truncate if needed
-        if self.token_counter:
-            tokens = self.token_counter.encode(text)
-            if len(tokens) > 8191:
-                text = self.token_counter.decode(tokens[:8191])
+        return self.embed_texts([text])[0]
 
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Generate embeddings for several texts in a single OpenAI request"""
         response = self.openai_client.embeddings.create(
-            input=text,
+            input=[self.truncate_for_embedding(text) for text in texts],
             model=self.model_name
         )
 
-        return response.data[0].embedding
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    # Transient rate-limit/network failures are retried with jittered backoff instead of aborting indexing
+    @retry(
+        wait=wait_random_exponential(min=1, max=30),
+        stop=stop_after_attempt(6),
+        retry=retry_if_exception_type((openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError)),
+        reraise=True,
+    )
+    async def aembed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Generate embeddings for several already-truncated texts using the async OpenAI client"""
+        response = await self.async_openai_client.embeddings.create(
+            input=texts,
+            model=self.model_name
+        )
+
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def point_id(self, path: str, chunk_id: int) -> int:
+        """Stable Qdrant point ID for a chunk of a file"""
+        return int(hashlib.blake2b(f"{path}#{chunk_id}".encode("utf-8"), digest_size=8).hexdigest(), 16)
+
+    def chunk_file(self, file_info: Dict[str, str]) -> List[Dict[str, Any]]:
+        """Split a file into overlapping chunks that each fit one embedding input"""
+        content = file_info["content"]
+
+        # Short files can't exceed the chunk size by much, so skip the tokenizer
+        if len(content) < MIN_CHUNK_CHARS:
+            texts = [(content, approx_tokens(content))]
+        elif self.token_counter:
+            tokens = self.token_counter.encode_ordinary(content)
+            step = CHUNK_TOKENS - CHUNK_OVERLAP_TOKENS
+            texts = [
+                (self.token_counter.decode(tokens[start:start + CHUNK_TOKENS]),
+                 len(tokens[start:start + CHUNK_TOKENS]))
+                for start in range(0, max(len(tokens) - CHUNK_OVERLAP_TOKENS, 1), step)
+            ]
+        else:
+            # Fallback: approximate 4 chars per token
+            size = CHUNK_TOKENS * 4
+            step = (CHUNK_TOKENS - CHUNK_OVERLAP_TOKENS) * 4
+            texts = [
+                (content[start:start + size], len(content[start:start + size]) // 4)
+                for start in range(0, max(len(content) - CHUNK_OVERLAP_TOKENS * 4, 1), step)
+            ]
+
+        # The embeddings API rejects empty inputs, so blank files and windows are not indexed
+        texts = [(text, n_tokens) for text, n_tokens in texts if text.strip()]
+
+        return [
+            {
+                "path": file_info["path"],
+                "chunk_id": chunk_id,
+                "content": text,
+                "n_tokens": n_tokens,
+                "digest": hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest(),
+                "content_hash": file_info["digest"],
+                "n_chunks": len(texts)
+            }
+            for chunk_id, (text, n_tokens) in enumerate(texts)
+        ]
+
+    def embedding_cache_key(self, chunk: Dict[str, Any]) -> str:
+        """Key for a chunk's embedding in the on-disk cache"""
+        return f"{self.model_name}:{chunk['digest']}"
+
+    def rejected_cache_key(self, content_hash: str) -> str:
+        """Key marking a file version that the embeddings API rejected"""
+        return f"{self.model_name}:rejected:{content_hash}"
+
+    def batch_for_embedding(self, chunks: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """Group chunks into embedding requests that respect the input and token limits"""
+        batches = []
+        batch = []
+        batch_tokens = 0
+
+        for chunk in chunks:
+            n_tokens = chunk["n_tokens"]
+
+            if batch and (len(batch) >= EMBEDDING_BATCH_SIZE or batch_tokens + n_tokens > MAX_TOKENS_PER_REQUEST):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+
+            batch.append(chunk)
+            batch_tokens += n_tokens
+
+        if batch:
+            batches.append(batch)
+
+        return batches
+
+    def read_file_text(self, relative_path: str) -> str:
+        """Read a codebase file as text, returning an empty string if it can't be read"""
+        try:
+            return (self.codebase_path / relative_path).read_text(encoding="utf-8", errors="ignore")
+        except Exception as e:
+            print(f"Error reading {relative_path}: {e}")
+            return ""
+
+    def read_code_file(self, file_path: Path) -> Optional[Dict[str, str]]:
+        """Read a single code file, returning None if it can't be read"""
+        try:
+            content = file_path.read_text(encoding="utf-8", errors="ignore")
+            relative_path = str(file_path.relative_to(self.codebase_path))
+
+            return {
+                "path": relative_path,
+                "content": content,
+                "digest": hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+            }
+        except Exception:
+            # Skip files that can't be read
+            return None
 
     def collect_code_files(self) -> List[Dict[str, str]]:
         """Collect code and config files from codebase using extension allowlist"""
@@ -95,149 +265,426 @@ class RAGPipeline:
             ".brv"
         }
 
-        code_files = []
         print(f"Collecting code files from {self.codebase_path}...")
 
-        for file_path in self.codebase_path.rglob("*"):
-            # Skip directories
-            if file_path.is_dir():
-                continue
-
-            # Skip ignored directories
-            if any(ignored in file_path.parts for ignored in ignore_dirs):
-                continue
-
-            # Only include allowed extensions
-            if file_path.suffix not in allowed_extensions:
-                continue
-
-            # Try to read as text file
+        def walk(directory: str):
+            """Yield allowed files under directory without descending into ignored directories"""
             try:
-                content = file_path.read_text(encoding="utf-8", errors="ignore")
-                relative_path = str(file_path.relative_to(self.codebase_path))
-
-                code_files.append({
-                    "path": relative_path,
-                    "content": content
-                })
-            except Exception as e:
-                # Skip files that can't be read
-                continue
+                entries = os.scandir(directory)
+            except OSError:
+                # Skip directories that can't be listed, e.g. due to permissions
+                return
+
+            with entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in ignore_dirs:
+                            yield from walk(entry.path)
+                    elif os.path.splitext(entry.name)[1] in allowed_extensions and entry.is_file():
+                        yield Path(entry.path)
+
+        candidate_paths = list(walk(str(self.codebase_path)))
+
+        # Read files on a thread pool so their I/O overlaps
+        with ThreadPoolExecutor(max_workers=(os.cpu_count() or 1) * 4) as executor:
+            code_files = [
+                file_info
+                for file_info in executor.map(self.read_code_file, candidate_paths)
+                if file_info is not None
+            ]
 
         print(f"Collected {len(code_files)} code files")
         return code_files
 
-    def create_collection(self):
-        """Create or recreate Qdrant collection"""
-        print(f"Creating collection: {self.collection_name}...")
+    def collection_is_current(self) -> bool:
+        """Check that the existing collection has the vector, quantization and payload index settings used here"""
+        info = self.qdrant_client.get_collection(self.collection_name)
+        vectors = info.config.params.vectors
+
+        return (
+            isinstance(vectors, VectorParams)
+            and vectors.size == self.embedding_dim
+            and vectors.datatype == models.Datatype.FLOAT16
+            and info.config.quantization_config is not None
+            and "path" in (info.payload_schema or {})
+        )
+
+    def create_collection(self, recreate: bool = False):
+        """Create the Qdrant collection, keeping an existing one unless recreate is set or its settings are outdated"""
+        if self.qdrant_client.collection_exists(self.collection_name):
+            if not recreate:
+                if self.collection_is_current():
+                    print(f"Using existing collection: {self.collection_name}")
+                    return
+                print(f"Existing collection {self.collection_name} uses outdated settings, recreating it")
 
-        # Delete collection if exists
-        try:
             self.qdrant_client.delete_collection(collection_name=self.collection_name)
             print("Deleted existing collection")
-        except:
-            pass
+
+        print(f"Creating collection: {self.collection_name}...")
 
         # Create new collection
         self.qdrant_client.create_collection(
             collection_name=self.collection_name,
-            vectors_config=VectorParams(size=self.embedding_dim, distance=Distance.COSINE)
+            # Originals are kept as float16: half the storage of float32 and plenty
+            # of precision for rescoring the quantized candidates
+            vectors_config=VectorParams(
+                size=self.embedding_dim,
+                distance=Distance.COSINE,
+                datatype=models.Datatype.FLOAT16
+            ),
+            # int8 quantized vectors kept in RAM cut memory ~4x and speed up scoring;
+            # search rescoring with the original vectors preserves recall
+            quantization_config=models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(
+                    type=models.ScalarType.INT8,
+                    quantile=0.99,
+                    always_ram=True
+                )
+            ),
+            hnsw_config=models.HnswConfigDiff(m=16, ef_construct=128)
+        )
+
+        # Files are split into several points, and retrieval groups them by path
+        self.qdrant_client.create_payload_index(
+            collection_name=self.collection_name,
+            field_name="path",
+            field_schema=PayloadSchemaType.KEYWORD
         )
         print("Collection created successfully")
 
-    def index_codebase(self):
-        """Index all code files into Qdrant"""
+    def indexed_file_hashes(self) -> Dict[str, Optional[str]]:
+        """Map each indexed file path to the content hash it was embedded from, or None if it is incomplete"""
+        hashes = {}
+        chunk_counts = {}
+        expected_counts = {}
+        offset = None
+
+        while True:
+            points, offset = self.qdrant_client.scroll(
+                collection_name=self.collection_name,
+                limit=10000,
+                offset=offset,
+                with_payload=["path", "content_hash", "n_chunks"],
+                with_vectors=False
+            )
+            for point in points:
+                path = point.payload["path"]
+                content_hash = point.payload.get("content_hash")
+                # Chunks from different versions of a file mean it was only partly re-indexed
+                if hashes.setdefault(path, content_hash) != content_hash:
+                    hashes[path] = None
+                chunk_counts[path] = chunk_counts.get(path, 0) + 1
+                expected_counts[path] = point.payload.get("n_chunks")
+
+            if offset is None:
+                break
+
+        # Files missing some of their chunks (e.g. after an interrupted run) count as changed
+        return {
+            path: content_hash if chunk_counts[path] == expected_counts[path] else None
+            for path, content_hash in hashes.items()
+        }
+
+    def delete_files(self, paths: List[str]):
+        """Delete every indexed chunk of the given files"""
+        if not paths:
+            return
+
+        self.qdrant_client.delete(
+            collection_name=self.collection_name,
+            points_selector=models.FilterSelector(
+                filter=models.Filter(
+                    must=[models.FieldCondition(key="path", match=models.MatchAny(any=paths))]
+                )
+            )
+        )
+
+    def index_codebase(self, recreate: bool = False):
+        """Index code files into Qdrant, re-embedding only files that changed since the last run"""
         code_files = self.collect_code_files()
 
         if not code_files:
             raise ValueError("No code files found to index")
 
-        self.create_collection()
+        self.create_collection(recreate=recreate)
+
+        # Diff the codebase against what the collection was built from
+        indexed = self.indexed_file_hashes()
+        current_paths = {file_info["path"] for file_info in code_files}
+        changed_files = [
+            file_info for file_info in code_files
+            if indexed.get(file_info["path"]) != file_info["digest"]
+        ]
+        removed_paths = [path for path in indexed if path not in current_paths]
+        n_unchanged = len(code_files) - len(changed_files)
+
+        # Changed files may now have fewer chunks, so drop their old points before re-adding
+        stale_paths = removed_paths + [
+            file_info["path"] for file_info in changed_files if file_info["path"] in indexed
+        ]
+        if stale_paths:
+            print(f"Removing {len(stale_paths)} changed or deleted files from the index")
+            self.delete_files(stale_paths)
+
+        # Blank files and file versions the embeddings API already rejected can never be
+        # embedded, so leave them out until they change instead of retrying them every run
+        embeddable_files = [
+            file_info for file_info in changed_files
+            if file_info["content"].strip()
+            and self.rejected_cache_key(file_info["digest"]) not in self.embedding_cache
+        ]
+        if len(embeddable_files) < len(changed_files):
+            print(f"Skipping {len(changed_files) - len(embeddable_files)} blank or previously rejected files")
+        changed_files = embeddable_files
+
+        if not changed_files:
+            print("Index is up to date")
+            return
+
+        print(f"Indexing {len(changed_files)} new or changed files "
+              f"({n_unchanged} unchanged)...")
+        failed_paths = asyncio.run(self._index_files(changed_files))
+
+        # Remove partially indexed files so the next run picks them up again
+        if failed_paths:
+            print(f"Failed to index {len(failed_paths)} files; files that hit transient errors "
+                  f"will be retried on the next run")
+            self.delete_files(failed_paths)
 
-        print(f"Indexing {len(code_files)} files...")
-        batch_size = 10
-        points = []
+        print("Indexing complete!")
 
-        for idx, file_info in enumerate(tqdm(code_files, desc="Embedding files")):
+    async def _index_files(self, code_files: List[Dict[str, str]]) -> List[str]:
+        """Embed file chunks concurrently, upload the resulting points in batches and return files that failed"""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        failed_paths = set()
+
+        chunks = [chunk for file_info in code_files for chunk in self.chunk_file(file_info)]
+        print(f"Split {len(code_files)} files into {len(chunks)} chunks")
+
+        progress = tqdm(total=len(chunks), desc="Embedding chunks")
+
+        def make_point(chunk: Dict[str, Any], embedding: List[float]) -> PointStruct:
+            # File contents are read from disk at retrieval time, so only identify the chunk
+            return PointStruct(
+                id=self.point_id(chunk["path"], chunk["chunk_id"]),
+                vector=embedding,
+                payload={
+                    "path": chunk["path"],
+                    "chunk_id": chunk["chunk_id"],
+                    "content_hash": chunk["content_hash"],
+                    "n_chunks": chunk["n_chunks"]
+                }
+            )
+
+        async def embed_chunks(batch: List[Dict[str, Any]]) -> List[Optional[List[float]]]:
+            # Create embeddings for the whole batch in one request
             try:
-                # Create embedding
-                embedding = self.embed_text(file_info["content"])
-
-                # Create point
-                point = PointStruct(
-                    id=idx,
-                    vector=embedding,
-                    payload={
-                        "path": file_info["path"],
-                        "content": file_info["content"][:1000],  # Store preview
-                        "full_content": file_info["content"]  # Store full content for token counting
-                    }
+                return await self.aembed_texts([chunk["content"] for chunk in batch])
+            except openai.BadRequestError as e:
+                if len(batch) == 1:
+                    print(f"Error indexing {batch[0]['path']}: {e}")
+                    return [None]
+
+            # One invalid input rejects the whole request, so embed the chunks one by one
+            # and only lose the ones that are rejected on their own
+            embeddings = []
+            for chunk in batch:
+                embeddings.extend(await embed_chunks([chunk]))
+            return embeddings
+
+        async def embed_batch(batch: List[Dict[str, Any]]) -> List[PointStruct]:
+            async with semaphore:
+                try:
+                    embeddings = await embed_chunks(batch)
+                except Exception as e:
+                    paths = {chunk["path"] for chunk in batch}
+                    failed_paths.update(paths)
+                    print(f"Error indexing {', '.join(sorted(paths))}: {e}")
+                    return []
+                finally:
+                    progress.update(len(batch))
+
+            points = []
+            for chunk, embedding in zip(batch, embeddings):
+                if embedding is None:
+                    # Rejected on its own, so this version of the file will never embed
+                    self.embedding_cache.set(self.rejected_cache_key(chunk["content_hash"]), True)
+                    failed_paths.add(chunk["path"])
+                    continue
+                self.embedding_cache.set(self.embedding_cache_key(chunk), embedding)
+                points.append(make_point(chunk, embedding))
+            return points
+
+        # Reuse cached embeddings and only send cache misses to OpenAI
+        cached_points = []
+        misses = []
+        for chunk in chunks:
+            embedding = self.embedding_cache.get(self.embedding_cache_key(chunk))
+            if embedding is None:
+                misses.append(chunk)
+            else:
+                cached_points.append(make_point(chunk, embedding))
+
+        if cached_points:
+            print(f"Using cached embeddings for {len(cached_points)} chunks")
+            progress.update(len(cached_points))
+            # All uploads wait until Qdrant has applied the points, so an evaluation
+            # run right after indexing searches the complete collection
+            self.qdrant_client.upload_points(
+                collection_name=self.collection_name,
+                points=cached_points,
+                batch_size=UPLOAD_BATCH_SIZE,
+                parallel=UPLOAD_PARALLEL,
+                wait=True
+            )
+
+        batches = self.batch_for_embedding(misses)
+        tasks = [embed_batch(batch) for batch in batches]
+        points = []
+
+        for next_batch in asyncio.as_completed(tasks):
+            points.extend(await next_batch)
+
+            # Upload in batches without blocking the embedding requests still in flight
+            if len(points) >= UPLOAD_BATCH_SIZE:
+                await asyncio.to_thread(
+                    self.qdrant_client.upload_points,
+                    collection_name=self.collection_name,
+                    points=points,
+                    batch_size=UPLOAD_BATCH_SIZE,
+                    wait=True
                 )
-                points.append(point)
-
-                # Upload in batches
-                if len(points) >= batch_size:
-                    self.qdrant_client.upsert(
-                        collection_name=self.collection_name,
-                        points=points
-                    )
-                    points = []
-            except Exception as e:
-                print(f"Error indexing {file_info['path']}: {e}")
-                continue
+                points = []
+        progress.close()
 
         # Upload remaining points
         if points:
-            self.qdrant_client.upsert(
+            await asyncio.to_thread(
+                self.qdrant_client.upload_points,
                 collection_name=self.collection_name,
-                points=points
+                points=points,
+                batch_size=UPLOAD_BATCH_SIZE,
+                wait=True
             )
 
-        print("Indexing complete!")
+        return sorted(failed_paths)
 
-    def retrieve(self, query: str) -> List[Dict[str, Any]]:
-        """Retrieve top-k files for a query"""
-        query_embedding = self.embed_text(query)
-
-        results = self.qdrant_client.query_points(
+    def search_files(self, query_embedding: List[float]) -> List[Tuple[str, float]]:
+        """Find the top-k files for a query embedding as (path, score) pairs"""
+        # Group chunk hits by file so the top-k are distinct files, each scored by its best chunk
+        groups = self.qdrant_client.query_points_groups(
             collection_name=self.collection_name,
             query=query_embedding,
-            limit=self.top_k
-        ).points
+            group_by="path",
+            limit=self.top_k,
+            group_size=1,
+            with_payload=False,
+            search_params=self.search_params
+        ).groups
+
+        return [(group.id, group.hits[0].score) for group in groups]
+
+    def search_files_batch(self, query_embeddings: List[List[float]]) -> List[List[Tuple[str, float]]]:
+        """Find the top-k files for many query embeddings in one Qdrant request"""
+        limit = self.top_k * RETRIEVE_OVERSAMPLING
+        responses = self.qdrant_client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=[
+                models.QueryRequest(
+                    query=query_embedding,
+                    limit=limit,
+                    params=self.search_params,
+                    with_payload=["path"]
+                )
+                for query_embedding in query_embeddings
+            ]
+        )
 
+        all_files = []
+        for query_embedding, response in zip(query_embeddings, responses):
+            # Merge chunk hits into files, scoring each file by its best chunk
+            file_scores = {}
+            for point in response.points:
+                path = point.payload["path"]
+                file_scores[path] = max(point.score, file_scores.get(path, point.score))
+
+            if len(file_scores) < self.top_k and len(response.points) == limit:
+                # A few files' chunks filled every slot, so let Qdrant group this query
+                all_files.append(self.search_files(query_embedding))
+            else:
+                top_files = sorted(file_scores.items(), key=lambda item: item[1], reverse=True)
+                all_files.append(top_files[:self.top_k])
+
+        return all_files
+
+    def load_retrieved_files(self, top_files: List[Tuple[str, float]], contents: Dict[str, str]) -> List[Dict[str, Any]]:
+        """Attach file contents to (path, score) search results"""
         retrieved_files = []
-        for result in results:
+        for path, score in top_files:
             retrieved_files.append({
-                "path": result.payload["path"],
-                "score": result.score,
-                "content": result.payload["full_content"]
+                "path": path,
+                "score": score,
+                "content": contents[path]
             })
 
         return retrieved_files
 
+    def read_files(self, paths: List[str]) -> Dict[str, str]:
+        """Read codebase files concurrently, keyed by path"""
+        unique_paths = list(dict.fromkeys(paths))
+        with ThreadPoolExecutor(max_workers=max(min(len(unique_paths), 32), 1)) as executor:
+            return dict(zip(unique_paths, executor.map(self.read_file_text, unique_paths)))
+
+    def retrieve(self, query: str) -> List[Dict[str, Any]]:
+        """Retrieve top-k files for a query"""
+        top_files = self.search_files(self.embed_text(query))
+
+        # Read the retrieved files from the codebase for token counting
+        contents = self.read_files([path for path, _ in top_files])
+        return self.load_retrieved_files(top_files, contents)
+
+    def retrieve_batch(self, queries: List[str]) -> List[List[Dict[str, Any]]]:
+        """Retrieve top-k files for many queries with batched embedding and search requests"""
+        all_top_files = []
+        for start in range(0, len(queries), QUERY_BATCH_SIZE):
+            query_embeddings = self.embed_texts(queries[start:start + QUERY_BATCH_SIZE])
+            all_top_files.extend(self.search_files_batch(query_embeddings))
+
+        # Read every retrieved file once, even if several queries returned it
+        contents = self.read_files([path for top_files in all_top_files for path, _ in top_files])
+        return [self.load_retrieved_files(top_files, contents) for top_files in all_top_files]
+
     def run_evaluation(self, questions_file: str, output_file: str):
         """Run evaluation on questions and save results"""
         print(f"Loading questions from {questions_file}...")
-        with open(questions_file, 'r') as f:
-            questions_data = json.load(f)
+        with open(questions_file, 'rb') as f:
+            questions_data = orjson.loads(f.read())
 
         questions = questions_data["questions"]
         results = []
 
+        # Build each question's ground truth set once up front
+        for question in questions:
+            question["_gt_set"] = frozenset(question["ground_truth"])
+
+        print(f"Retrieving files for {len(questions)} questions...")
+        all_retrieved = self.retrieve_batch([question["question"] for question in questions])
+
+        # Count tokens once per distinct retrieved file, in a single batched call
+        file_contents = {r["path"]: r["content"] for retrieved in all_retrieved for r in retrieved}
+        file_tokens = dict(zip(file_contents, self.count_tokens_batch(list(file_contents.values()))))
+
         print(f"Processing {len(questions)} questions...")
-        for question in tqdm(questions, desc="Evaluating questions"):
-            # Retrieve relevant files
-            retrieved = self.retrieve(question["question"])
+        sum_iou = sum_tokens = sum_precision = sum_recall = 0.0
+        for question, retrieved in tqdm(zip(questions, all_retrieved), total=len(questions), desc="Evaluating questions"):
             retrieved_paths = [r["path"] for r in retrieved]
 
             # Calculate token usage (sum of all retrieved file contents)
-            total_tokens = sum(
-                self.count_tokens(r["content"])
-                for r in retrieved
-            )
+            total_tokens = sum(file_tokens[r["path"]] for r in retrieved)
 
             # Calculate intersection over union metric
-            ground_truth = set(question["ground_truth"])
+            ground_truth = question["_gt_set"]
             retrieved_set = set(retrieved_paths)
 
             intersection = len(ground_truth & retrieved_set)
@@ -259,11 +706,18 @@ class RAGPipeline:
             }
             results.append(result)
 
+            metrics = result["metrics"]
+            sum_iou += metrics["iou"]
+            sum_tokens += metrics["token_usage"]
+            sum_precision += metrics["precision"]
+            sum_recall += metrics["recall"]
+
         # Calculate aggregate metrics
-        avg_iou = sum(r["metrics"]["iou"] for r in results) / len(results)
-        avg_tokens = sum(r["metrics"]["token_usage"] for r in results) / len(results)
-        avg_precision = sum(r["metrics"]["precision"] for r in results) / len(results)
-        avg_recall = sum(r["metrics"]["recall"] for r in results) / len(results)
+        n = len(results) or 1
+        avg_iou = sum_iou / n
+        avg_tokens = sum_tokens / n
+        avg_precision = sum_precision / n
+        avg_recall = sum_recall / n
 
         output_data = {
             "approach": "RAG",
@@ -283,8 +737,8 @@ class RAGPipeline:
         output_path = Path(output_file)
         output_path.parent.mkdir(parents=True, exist_ok=True)
 
-        with open(output_file, 'w') as f:
-            json.dump(output_data, f, indent=2)
+        with open(output_file, 'wb') as f:
+            f.write(orjson.dumps(output_data, option=orjson.OPT_INDENT_2))
 
         print("\n=== RAG Pipeline Results ===")
         print(f"Average IoU: {avg_iou:.3f}")
@@ -325,22 +779,41 @@ def main():
         action="store_true",
         help="Only run evaluation, assume codebase is already indexed"
     )
+    parser.add_argument(
+        "--reindex",
+        action="store_true",
+        help="Drop the existing collection and index the whole codebase from scratch"
+    )
     parser.add_argument(
         "--top-k",
         type=int,
         default=5,
         help="Number of top results to retrieve"
     )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=16,
+        help="Maximum number of concurrent embedding requests while indexing"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default="./.embed_cache",
+        help="Directory for the on-disk embedding cache"
+    )
 
     args = parser.parse_args()
 
     pipeline = RAGPipeline(
         codebase_path=args.codebase,
-        top_k=args.top_k
+        top_k=args.top_k,
+        max_concurrency=args.max_concurrency,
+        cache_dir=args.cache_dir
     )
 
     if not args.eval_only:
-        pipeline.index_codebase()
+        pipeline.index_codebase(recreate=args.reindex)
 
     if not args.index_only:
         pipeline.run_evaluation(args.questions, args.output)
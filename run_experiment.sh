@@ -117,6 +117,9 @@ source venv/bin/activate
 
 pip install -q -r requirements.txt
 
+# Download tokenizer files once so pipeline runs load them from local disk
+python tools/prewarm_tiktoken.py > /dev/null
+
 echo -e "${GREEN}✓ Dependencies installed${NC}"
 echo ""
 
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Shared tiktoken setup for the pipelines
+Keeps BPE files in a repo-local cache and loads each encoding once per process
+"""
+
+import functools
+import os
+from pathlib import Path
+from typing import List, Optional
+import tiktoken
+
+# Keep the downloaded BPE files next to the repo so they are not refetched per run
+TIKTOKEN_CACHE_DIR = os.environ.setdefault(
+    "TIKTOKEN_CACHE_DIR", str(Path(__file__).resolve().parent / ".tiktoken_cache")
+)
+
+
+@functools.lru_cache(maxsize=8)
+def get_encoder(name: str = "cl100k_base") -> tiktoken.Encoding:
+    """Load a tiktoken encoding once per process"""
+    return tiktoken.get_encoding(name)
+
+
+def count_tokens_batch(encoder: Optional[tiktoken.Encoding], texts: List[str]) -> List[int]:
+    """Count tokens for many texts in a single batched tiktoken call"""
+    if encoder:
+        encoded = encoder.encode_ordinary_batch(texts, num_threads=os.cpu_count() or 1)
+        return [len(tokens) for tokens in encoded]
+    else:
+        # Fallback: approximate 4 chars per token
+        return [len(text) // 4 for text in texts]
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Pre-warm the tiktoken cache
+Downloads every known BPE encoding into TIKTOKEN_CACHE_DIR so pipeline runs load them from disk
+"""
+
+import sys
+from pathlib import Path
+
+# Share the cache location and encoder loading with the pipelines in the repo root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import tiktoken.model
+from token_utils import TIKTOKEN_CACHE_DIR, get_encoder
+
+
+def main():
+    print(f"Pre-warming tiktoken cache in {TIKTOKEN_CACHE_DIR}...")
+
+    for encoding_name in sorted(set(tiktoken.model.MODEL_TO_ENCODING.values())):
+        try:
+            get_encoder(encoding_name)
+            print(f"✓ Cached: {encoding_name}")
+        except Exception as e:
+            print(f"Warning: Could not load {encoding_name}: {e}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
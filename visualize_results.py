@@ -5,6 +5,8 @@ Creates bar plots comparing token usage, precision, recall, and IoU
 """
 
 import json
+import matplotlib
+matplotlib.use('Agg')  # Files only; skip GUI backend probing
 import matplotlib.pyplot as plt
 import numpy as np
 from pathlib import Path
@@ -16,183 +18,94 @@ def load_comparison_data(comparison_file: str):
         return json.load(f)
 
 
-def create_comparison_plots(data: dict, output_dir: str = "./results"):
-    """Create 4 comparison plots and save as PNG"""
-    output_path = Path(output_dir)
-    output_path.mkdir(parents=True, exist_ok=True)
+# (file name, short name, y label, metric key, improvement key, improvement label, value formatter, clamp y axis)
+METRICS = [
+    ('token_usage_comparison.png', 'Token Usage', 'Average Token Usage', 'avg_token_usage',
+     'token_reduction_pct', 'Token Reduction', lambda value: f'{int(value):,}', False),
+    ('precision_comparison.png', 'Precision', 'Average Precision', 'avg_precision',
+     'precision_improvement_pct', 'Precision Improvement', '{:.3f}'.format, True),
+    ('recall_comparison.png', 'Recall', 'Average Recall', 'avg_recall',
+     'recall_improvement_pct', 'Recall Improvement', '{:.3f}'.format, True),
+    ('iou_comparison.png', 'IoU Score', 'Average IoU Score', 'avg_iou',
+     'iou_improvement_pct', 'IoU Improvement', '{:.3f}'.format, True),
+]
 
-    # Extract metrics
-    rag_metrics = data["aggregate_comparison"]["rag"]
-    agentic_metrics = data["aggregate_comparison"]["agentic"]
+APPROACHES = ['RAG', 'Agentic Search']
+COLORS = ['#3498db', '#e74c3c']  # Blue for RAG, Red for Agentic
 
-    # Set style
-    plt.style.use('seaborn-v0_8-darkgrid')
-    colors = ['#3498db', '#e74c3c']  # Blue for RAG, Red for Agentic
 
-    # Common figure settings
-    fig_width = 10
-    fig_height = 6
+def _plot_one(ax, title: str, ylabel: str, values, improvement_text: str, value_fmt,
+              use_ylim: bool = True, annotation_x: float = 0.5, compact: bool = False):
+    """Draw one RAG vs Agentic bar chart with value labels and an improvement annotation"""
+    label_size, title_size, note_size = (12, 14, 10) if compact else (14, 16, 12)
 
-    # 1. Token Usage Comparison
-    fig, ax = plt.subplots(figsize=(fig_width, fig_height))
-    approaches = ['RAG', 'Agentic Search']
-    token_values = [rag_metrics['avg_token_usage'], agentic_metrics['avg_token_usage']]
-
-    bars = ax.bar(approaches, token_values, color=colors, alpha=0.8, edgecolor='black', linewidth=1.5)
+    bars = ax.bar(APPROACHES, values, color=COLORS, alpha=0.8, edgecolor='black', linewidth=1.5)
 
     # Add value labels on bars
-    for i, bar in enumerate(bars):
+    for bar in bars:
         height = bar.get_height()
         ax.text(bar.get_x() + bar.get_width()/2., height,
-                f'{int(height):,}',
-                ha='center', va='bottom', fontsize=14, fontweight='bold')
+                value_fmt(height),
+                ha='center', va='bottom', fontsize=label_size, fontweight='bold')
 
-    ax.set_ylabel('Average Token Usage', fontsize=14, fontweight='bold')
-    ax.set_title('Token Usage Comparison: RAG vs Agentic Search', fontsize=16, fontweight='bold', pad=20)
+    ax.set_ylabel(ylabel, fontsize=label_size, fontweight='bold')
+    ax.set_title(title, fontsize=title_size, fontweight='bold', pad=10 if compact else 20)
+    if use_ylim:
+        ax.set_ylim(0, max(values) * 1.25)
     ax.grid(axis='y', alpha=0.3)
 
-    # Add improvement annotation
-    improvement = data["aggregate_comparison"]["improvements"]["token_reduction_pct"]
-    ax.text(0.75, 0.95, f'Token Reduction: {improvement:+.1f}%',
+    ax.text(annotation_x, 0.95, improvement_text,
             transform=ax.transAxes, ha='center', va='top',
             bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.5),
-            fontsize=12, fontweight='bold')
-
-    plt.tight_layout()
-    plt.savefig(output_path / 'token_usage_comparison.png', dpi=300, bbox_inches='tight')
-    plt.close()
-    print(f"✓ Saved: {output_path / 'token_usage_comparison.png'}")
-
-    # 2. Precision Comparison
-    fig, ax = plt.subplots(figsize=(fig_width, fig_height))
-    precision_values = [rag_metrics['avg_precision'], agentic_metrics['avg_precision']]
-
-    bars = ax.bar(approaches, precision_values, color=colors, alpha=0.8, edgecolor='black', linewidth=1.5)
-
-    for i, bar in enumerate(bars):
-        height = bar.get_height()
-        ax.text(bar.get_x() + bar.get_width()/2., height,
-                f'{height:.3f}',
-                ha='center', va='bottom', fontsize=14, fontweight='bold')
-
-    ax.set_ylabel('Average Precision', fontsize=14, fontweight='bold')
-    ax.set_title('Precision Comparison: RAG vs Agentic Search', fontsize=16, fontweight='bold', pad=20)
-    ax.set_ylim(0, max(precision_values) * 1.25)
-    ax.grid(axis='y', alpha=0.3)
-
-    improvement = data["aggregate_comparison"]["improvements"]["precision_improvement_pct"]
-    ax.text(0.5, 0.95, f'Precision Improvement: {improvement:+.1f}%',
-            transform=ax.transAxes, ha='center', va='top',
-            bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.5),
-            fontsize=12, fontweight='bold')
-
-    plt.tight_layout()
-    plt.savefig(output_path / 'precision_comparison.png', dpi=300, bbox_inches='tight')
-    plt.close()
-    print(f"✓ Saved: {output_path / 'precision_comparison.png'}")
+            fontsize=note_size, fontweight='bold')
 
-    # 3. Recall Comparison
-    fig, ax = plt.subplots(figsize=(fig_width, fig_height))
-    recall_values = [rag_metrics['avg_recall'], agentic_metrics['avg_recall']]
-
-    bars = ax.bar(approaches, recall_values, color=colors, alpha=0.8, edgecolor='black', linewidth=1.5)
 
-    for i, bar in enumerate(bars):
-        height = bar.get_height()
-        ax.text(bar.get_x() + bar.get_width()/2., height,
-                f'{height:.3f}',
-                ha='center', va='bottom', fontsize=14, fontweight='bold')
+def create_comparison_plots(data: dict, output_dir: str = "./results"):
+    """Create 4 comparison plots and save as PNG"""
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
 
-    ax.set_ylabel('Average Recall', fontsize=14, fontweight='bold')
-    ax.set_title('Recall Comparison: RAG vs Agentic Search', fontsize=16, fontweight='bold', pad=20)
-    ax.set_ylim(0, max(recall_values) * 1.25)
-    ax.grid(axis='y', alpha=0.3)
+    # Extract metrics
+    rag_metrics = data["aggregate_comparison"]["rag"]
+    agentic_metrics = data["aggregate_comparison"]["agentic"]
+    improvements = data["aggregate_comparison"]["improvements"]
 
-    improvement = data["aggregate_comparison"]["improvements"]["recall_improvement_pct"]
-    ax.text(0.5, 0.95, f'Recall Improvement: {improvement:+.1f}%',
-            transform=ax.transAxes, ha='center', va='top',
-            bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.5),
-            fontsize=12, fontweight='bold')
+    # Set style
+    plt.style.use('seaborn-v0_8-darkgrid')
 
-    plt.tight_layout()
-    plt.savefig(output_path / 'recall_comparison.png', dpi=300, bbox_inches='tight')
-    plt.close()
-    print(f"✓ Saved: {output_path / 'recall_comparison.png'}")
+    # Common figure settings
+    fig_width = 10
+    fig_height = 6
 
-    # 4. IoU Comparison
+    # 1-4. One reused figure for every metric; 150 dpi is plenty for on-screen viewing
     fig, ax = plt.subplots(figsize=(fig_width, fig_height))
-    iou_values = [rag_metrics['avg_iou'], agentic_metrics['avg_iou']]
-
-    bars = ax.bar(approaches, iou_values, color=colors, alpha=0.8, edgecolor='black', linewidth=1.5)
-
-    for i, bar in enumerate(bars):
-        height = bar.get_height()
-        ax.text(bar.get_x() + bar.get_width()/2., height,
-                f'{height:.3f}',
-                ha='center', va='bottom', fontsize=14, fontweight='bold')
+    for filename, name, ylabel, key, improvement_key, improvement_label, value_fmt, use_ylim in METRICS:
+        values = [rag_metrics[key], agentic_metrics[key]]
+        improvement = improvements[improvement_key]
 
-    ax.set_ylabel('Average IoU Score', fontsize=14, fontweight='bold')
-    ax.set_title('IoU Score Comparison: RAG vs Agentic Search', fontsize=16, fontweight='bold', pad=20)
-    ax.set_ylim(0, max(iou_values) * 1.25)
-    ax.grid(axis='y', alpha=0.3)
+        ax.clear()
+        # The token bars are very uneven, so keep the annotation clear of the tall RAG bar
+        _plot_one(ax, f'{name} Comparison: RAG vs Agentic Search', ylabel, values,
+                  f'{improvement_label}: {improvement:+.1f}%', value_fmt,
+                  use_ylim=use_ylim, annotation_x=0.5 if use_ylim else 0.75)
 
-    improvement = data["aggregate_comparison"]["improvements"]["iou_improvement_pct"]
-    ax.text(0.5, 0.95, f'IoU Improvement: {improvement:+.1f}%',
-            transform=ax.transAxes, ha='center', va='top',
-            bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.5),
-            fontsize=12, fontweight='bold')
-
-    plt.tight_layout()
-    plt.savefig(output_path / 'iou_comparison.png', dpi=300, bbox_inches='tight')
-    plt.close()
-    print(f"✓ Saved: {output_path / 'iou_comparison.png'}")
+        fig.tight_layout()
+        fig.savefig(output_path / filename, dpi=150, bbox_inches='tight')
+        print(f"✓ Saved: {output_path / filename}")
+    plt.close(fig)
 
     # 5. Bonus: All Metrics Combined (4 subplots in one figure)
     fig, axes = plt.subplots(2, 2, figsize=(16, 12))
     fig.suptitle('RAG vs Agentic Search: Complete Comparison', fontsize=18, fontweight='bold')
 
-    metrics = [
-        ('Token Usage', [rag_metrics['avg_token_usage'], agentic_metrics['avg_token_usage']],
-         'token_reduction_pct', False),
-        ('Precision', precision_values, 'precision_improvement_pct', True),
-        ('Recall', recall_values, 'recall_improvement_pct', True),
-        ('IoU Score', iou_values, 'iou_improvement_pct', True)
-    ]
-
-    for idx, (metric_name, values, improvement_key, use_ylim) in enumerate(metrics):
-        row = idx // 2
-        col = idx % 2
-        ax = axes[row, col]
-
-        bars = ax.bar(approaches, values, color=colors, alpha=0.8, edgecolor='black', linewidth=1.5)
-
-        # Add value labels
-        for bar in bars:
-            height = bar.get_height()
-            if metric_name == 'Token Usage':
-                label = f'{int(height):,}'
-            else:
-                label = f'{height:.3f}'
-            ax.text(bar.get_x() + bar.get_width()/2., height,
-                    label, ha='center', va='bottom', fontsize=12, fontweight='bold')
-
-        ax.set_ylabel(f'Average {metric_name}', fontsize=12, fontweight='bold')
-        ax.set_title(metric_name, fontsize=14, fontweight='bold', pad=10)
-        if use_ylim:
-            ax.set_ylim(0, max(values) * 1.25)
-        ax.grid(axis='y', alpha=0.3)
-
-        # Add improvement
-        improvement = data["aggregate_comparison"]["improvements"][improvement_key]
-        improvement_text = f'{improvement:+.1f}%'
-        ax.text(0.5, 0.95, improvement_text,
-                transform=ax.transAxes, ha='center', va='top',
-                bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.5),
-                fontsize=10, fontweight='bold')
+    for ax, (_, name, ylabel, key, improvement_key, _, value_fmt, use_ylim) in zip(axes.flat, METRICS):
+        values = [rag_metrics[key], agentic_metrics[key]]
+        _plot_one(ax, name, ylabel, values, f'{improvements[improvement_key]:+.1f}%', value_fmt,
+                  use_ylim=use_ylim, compact=True)
 
     plt.tight_layout()
     plt.savefig(output_path / 'all_metrics_comparison.png', dpi=300, bbox_inches='tight')
-    plt.close()
+    plt.close(fig)
     print(f"✓ Saved: {output_path / 'all_metrics_comparison.png'}")
 
 